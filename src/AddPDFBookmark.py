@@ -13,15 +13,18 @@
 # limitations under the License.
 
 import os
+import re
 import logging
 import logging.config
 
 from PyPDF2 import PdfFileWriter, PdfFileReader
-
-logging.config.fileConfig("resources/logger.config")
+from PyPDF2.generic import NameObject, NumberObject
 
 LOG = logging.getLogger('log02')
 
+# {title}{first space}{page no}, matched after {layer}
+BOOKMARK_PATTERN = re.compile(r'([^ ]+) +([^ ].*)')
+
 
 class BookmarkParser:
     """书签解析器
@@ -34,6 +37,8 @@ class BookmarkParser:
     {page no}: 页码，必须是正整数
     """
 
+    __slots__ = ('__path', '__line_no', '__page_no_base')
+
     def __init__(self, path):
         """初始化书签解析器
 
@@ -50,59 +55,67 @@ class BookmarkParser:
         """解析书签
 
         Returns:
-            3 个元素组成的元组列表：（级别，标题，页码）
+            5 个元素组成的元组列表：（ID，父 ID，级别，标题，页码）
         """
         LOG.info('开始解析书签')
-        bm_list = self.__read_bookmark_as_list()
-        if bm_list is None or len(bm_list) == 0:
-            LOG.warn('书签内容为空'.format(self.__path))
-            return None
-
-        bml = []
-        self.__line_no = 0
-        for bm in bm_list:
-            self.__line_no += 1
-            bm = BookmarkParser.__remove_end_line_char(bm)
-            # match page no base
-            if self.__line_no == 1:
-                self.__page_no_base = self.__parse_page_no_base(bm)
-                continue
-            # parse bookmark
-            if bm is None or len(bm) == 0:
-                continue
-            bml.append(self.__parse_bookmark(bm))
-
-        bml = BookmarkParser.__add_id_parent_id(bml)
-        bml = BookmarkParser.__add_serial_no_to_title(bml)
-        return bml
-
-    def __read_bookmark_as_list(self):
-        """读取书签为字符串列表
-
-        Returns:
-            书签字符串列表
-        """
         LOG.debug('开始读取书签文件')
-        bm_list = []
-        with open(file=self.__path, encoding='UTF-8') as bm:
-            for i in bm:
-                bm_list.append(i)
-        return bm_list
+        with open(file=self.__path, encoding='UTF-8',
+                  buffering=64 * 1024) as f:
+            lines = enumerate(f, start=1)
+            first = next(lines, None)
+            if first is None:
+                LOG.warn('书签内容为空')
+                return None
 
-    @staticmethod
-    def __remove_end_line_char(str):
-        """删除末尾的换行字符
-
-        Args:
-            str: 字符串
-        Returns:
-            None 或末尾不带换行字符的字符串
-        """
-        if str is None or len(str) == 0:
+            # match page no base
+            (self.__line_no, bm) = first
+            bm = bm.rstrip('\n')
+            self.__page_no_base = self.__parse_page_no_base(bm)
+
+            bml = []
+            # index is layer, value is the last bookmark ID of that layer
+            parent_id_list = []
+            # serial no of each layer, from the top layer down to current layer
+            serial_no_list = []
+            # str() of serial_no_list, only the changed layer is formatted
+            serial_no_str_list = []
+            for (self.__line_no, bm) in lines:
+                # skip empty line
+                if bm == '\n':
+                    continue
+                # parse bookmark
+                bm = bm.rstrip('\n')
+                (layer, title, page_no) = self.__parse_bookmark(bm)
+
+                # add ID and parent ID
+                id = len(bml) + 1
+                if layer > len(parent_id_list):
+                    self._raise_message('layer 格式错误，缺少上一级书签')
+                parent_id = parent_id_list[layer - 1] if layer > 0 else None
+                if layer < len(parent_id_list):
+                    parent_id_list[layer] = id
+                else:
+                    parent_id_list.append(id)
+
+                # add serial no to title
+                depth = layer + 1
+                del serial_no_list[depth:]
+                del serial_no_str_list[depth:]
+                missing = depth - len(serial_no_list)
+                serial_no_list.extend([0] * missing)
+                serial_no_str_list.extend(['0'] * missing)
+                serial_no_list[-1] += 1
+                serial_no_str_list[-1] = str(serial_no_list[-1])
+                if title.startswith('@'):
+                    title = title[1:]
+                else:
+                    title = '.'.join(serial_no_str_list) + ' ' + title
+
+                bml.append((id, parent_id, layer, title, page_no))
+
+        if len(bml) == 0:
             return None
-        if str[len(str) - 1] == '\n':
-            return str[0:len(str) - 1]
-        return str
+        return bml
 
     def __parse_page_no_base(self, str):
         """解析第一行实际页码的递增基数
@@ -113,11 +126,7 @@ class BookmarkParser:
         if str is None or len(str) == 0:
             return 0
 
-        for c in str:
-            if c < '0' or c > '9':
-                self._raise_message('page no 不是数字')
-
-        return int(str)
+        return self.__parse_int(str)
 
     def __parse_bookmark(self, str):
         """解析书签
@@ -128,92 +137,34 @@ class BookmarkParser:
             3 个元素的元组：（级别，标题，页码）
         """
         # bookmark = {layer}{title}{first space}{page no}
-        if str is None or len(str) == 0:
-            LOG.warn('跳过解析空行')
-            return
-
-        i = 0
-        (i, layer) = self.__match_layer(str, i)
-        (i, title) = self.__match_title(str, i)
-        (i, _) = self.__match_first_space(str, i)
-        (i, page_no) = self.__match_page_no(str, i)
-
-        return (layer, title, page_no)
-
-    def __match_layer(self, str, s):
-        """匹配级别
-
-        Args:
-            str: 书签字符串
-            s: 开始位置
-        Returns:
-            2 个元素的元组：(下一个位置，级别)
-        """
-        self.__check_str_index(str, s)
-
-        if str[s] != ' ':
-            return (s, 0)
-
-        e = BookmarkParser.__space_end_index(str, s)
-        self.__check_str_index(str, e)
-
-        space_len = e - s + 1
+        space_len = len(str) - len(str.lstrip(' '))
         if space_len % 4 != 0:
             self._raise_message('layer 格式错误，空格长度：{}'.format(space_len))
-        return (e + 1, space_len / 4)
+        layer = space_len // 4
 
-    def __match_title(self, str, s):
-        """匹配标题
+        m = BOOKMARK_PATTERN.fullmatch(str, space_len)
+        if m is None:
+            self._raise_message('格式错误')
+        (title, page_no) = m.groups()
 
-        Args:
-            str: 书签字符串
-            s: 开始位置
-        Returns:
-            2 个元素的元组：(下一个位置，标题)
-        """
-        self.__check_str_index(str, s)
+        page_no = self.__parse_int(page_no)
+        if page_no < 1:
+            self._raise_message(
+                'page no 错误，page no: {}'.format(page_no))
 
-        e = BookmarkParser.__space_start_index(str, s)
-        self.__check_str_index(str, e)
-        return (e, str[s:e])
+        return (layer, title, page_no + self.__page_no_base)
 
-    def __match_first_space(self, str, s):
-        """匹配第一个分隔符
+    def __parse_int(self, str):
+        """解析由 0-9 组成的页码数字
 
         Args:
-            str: 书签字符串
-            s: 开始位置
+            str: 页码字符串
         Returns:
-            2 个元素的元组：(下一个位置，None)
+            页码整数
         """
-        self.__check_str_index(str, s)
-        e = BookmarkParser.__space_end_index(str, s)
-        self.__check_str_index(str, e)
-        return (e + 1, None)
-
-    def __match_page_no(self, str, s):
-        """匹配页码
-
-        Args:
-            str: 书签字符串
-            s: 开始位置
-        Returns:
-            2 个元素的元祖：(下一个位置，页码)
-        """
-        self.__check_str_index(str, s)
-        page_no = str[s:len(str)]
-        for c in page_no:
-            if c < '0' or c > '9':
-                self._raise_message('page no 不是数字')
-        page_no = int(page_no)
-        if page_no < 1:
-            self._raise_message(
-                'page no 错误，page no: {}'.format(page_no))
-        return (len(str), page_no + self.__page_no_base)
-
-    def __check_str_index(self, str, i):
-        if i < 0 or i >= len(str):
-            self._raise_message('格式错误')
+        if not (str.isascii() and str.isdigit()):
+            self._raise_message('page no 不是数字')
+        return int(str)
 
     def _raise_message(self, message):
         """抛出与当前行号相关的异常
@@ -225,96 +176,6 @@ class BookmarkParser:
         """
         raise RuntimeError('line {}: {}'.format(self.__line_no, message))
 
-    @staticmethod
-    def __space_start_index(str, start):
-        """从指定位置开始查找空格出现的第一个位置
-
-        Args:
-            str: 字符串
-            start: 开始位置
-        Returns:
-            空格开始位置或 -1 如果没有空格
-        """
-        while start < len(str) and str[start] != ' ':
-            start += 1
-        if start < len(str) and str[start] == ' ':
-            return start
-        else:
-            return -1
-
-    @staticmethod
-    def __space_end_index(str, start):
-        """从指定位置开始查找空格结束的位置
-
-        Args:
-            str: 字符串
-            start: 空格开始位置
-        Returns:
-            空格结束位置或 -1 如果没有空格
-        """
-        while start < len(str) and str[start] == ' ':
-            start += 1
-        return start - 1
-
-    @staticmethod
-    def __add_id_parent_id(bookmark_list):
-        LOG.debug('开始建立元组 ID 关系')
-        if bookmark_list is None or len(bookmark_list) == 0:
-            return None
-        bml = []
-        id = 0
-        # layer -> parent ID
-        parent_id_dict = {}
-        for bm in bookmark_list:
-            id += 1
-            (layer, title, page_no) = bm
-            parent_id = None
-            if layer > 0:
-                parent_id = parent_id_dict[layer - 1]
-            bm = (id, parent_id, layer, title, page_no)
-            parent_id_dict[layer] = id
-            bml.append(bm)
-        return bml
-
-    @staticmethod
-    def __add_serial_no_to_title(bookmark_list):
-        LOG.debug('开始设置书签章节标题')
-        if bookmark_list is None or len(bookmark_list) == 0:
-            return None
-        bm_list = []
-        serial_no_dict = {}
-        for bm in bookmark_list:
-            (id, parent_id, layer, title, page_no) = bm
-            serial_no_dict = BookmarkParser.__incremental_serial_no(
-                serial_no_dict, layer)
-            if title.startswith('@'):
-                title = title[1:]
-            else:
-                title = BookmarkParser.__get_serial_no_string(
-                    serial_no_dict, layer) + ' ' + title
-            bm_list.append((id, parent_id, layer, title, page_no))
-        return bm_list
-
-    @staticmethod
-    def __incremental_serial_no(old_serial_no_dict, layer):
-        serial_no_dict = {}
-        for i in range(0, int(layer + 1)):
-            if i in old_serial_no_dict:
-                serial_no_dict[i] = old_serial_no_dict[i]
-            else:
-                serial_no_dict[i] = 0
-        serial_no_dict[layer] += 1
-        return serial_no_dict
-
-    @staticmethod
-    def __get_serial_no_string(serial_no_dict, layer):
-        serial_no = ''
-        for i in range(0, int(layer + 1)):
-            if serial_no != '':
-                serial_no += '.'
-            serial_no += str(serial_no_dict[i])
-        return serial_no
-
 
 def __main_core():
     LOG.info('开始添加书签')
@@ -329,25 +190,29 @@ def __main_core():
     try:
         with open('resources/input.pdf', 'rb') as i:
             input = PdfFileReader(i)
-            LOG.debug('PDF 总页数：{}'.format(input.numPages))
+            LOG.debug('PDF 总页数：%s', input.numPages)
 
             output = PdfFileWriter()
             LOG.info('开始复制 PDF 文件')
-            for i in range(0, input.numPages):
-                output.addPage(input.getPage(i))
+            if hasattr(output, 'appendPagesFromReader'):
+                output.appendPagesFromReader(input)
+            else:
+                # PyPDF2 < 1.26 没有 appendPagesFromReader
+                __append_pages_from_reader(output, input)
 
             LOG.info('开始添加书签到 PDF 文件')
             # id -> bookmark object
             bm_dict = {}
             if bm_list is not None and len(bm_list) > 0:
+                add_bookmark = output.addBookmark
                 for bm in bm_list:
                     (id, parent_id, _, title, page_no) = bm
                     parent = None
                     if parent_id is not None:
                         parent = bm_dict[parent_id]
-                    bookmark = output.addBookmark(title, page_no, parent)
+                    bookmark = add_bookmark(title, page_no, parent)
                     LOG.debug(
-                        '成功添加书签到 PDF 文件副本：{}，页码：{}'.format(title, page_no))
+                        '成功添加书签到 PDF 文件副本：%s，页码：%s', title, page_no)
                     bm_dict[id] = bookmark
 
             LOG.info('开始写出 PDF 文件')
@@ -358,21 +223,60 @@ def __main_core():
         LOG.error('添加书签错误：{}'.format(e))
 
 
+def __append_pages_from_reader(output, input):
+    """复制 PDF 文件的全部页面
+
+    所有页面加入 output 后一次性追加到 /Kids 数组并更新 /Count，
+    无法访问 PdfFileWriter 内部结构时逐页 addPage
+
+    Args:
+        output: PdfFileWriter 对象
+        input: PdfFileReader 对象
+    """
+    if not (hasattr(output, '_pages') and hasattr(output, '_addObject')):
+        add_page = output.addPage
+        get_page = input.getPage
+        for i in range(input.numPages):
+            add_page(get_page(i))
+        return
+
+    parent = output._pages
+    add_object = output._addObject
+    get_page = input.getPage
+    kids = []
+    for i in range(input.numPages):
+        page = get_page(i)
+        page[NameObject('/Parent')] = parent
+        kids.append(add_object(page))
+
+    pages = parent.getObject()
+    pages[NameObject('/Kids')].extend(kids)
+    pages[NameObject('/Count')] = NumberObject(pages['/Count'] + len(kids))
+
+
 def __rebuild_dist_dir_and_output_pdf():
     dist = 'dist'
-    if not os.path.exists(dist):
-        os.mkdir(dist)
-    if os.path.isfile(dist):
+    try:
+        os.makedirs(dist, exist_ok=True)
+    except FileExistsError:
+        # dist 是文件
         os.remove(dist)
         os.mkdir(dist)
 
     output_pdf = dist + '/output.pdf'
-    if os.path.exists(output_pdf):
-        if os.path.isfile(output_pdf):
-            os.remove(output_pdf)
-        else:
+    try:
+        os.remove(output_pdf)
+    except FileNotFoundError:
+        pass
+    except (IsADirectoryError, PermissionError):
+        # 删除目录时 Linux 抛出 IsADirectoryError，macOS 和 Windows 抛出
+        # PermissionError
+        if os.path.isdir(output_pdf):
             os.rmdir(output_pdf)
+        else:
+            raise
 
 
 if __name__ == '__main__':
+    logging.config.fileConfig("resources/logger.config")
     __main_core()